@@ -2,19 +2,17 @@ import gurobipy as gp
 from gurobipy import GRB
 import numpy as np
 import math
+import os
+import json
+import gzip
+import hashlib
+import time
+import uuid
 
 
-def run_F3(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800, print_out=False):
+def build_F3(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q):
     model = gp.Model("Compact formulation with loading variables")
 
-    # supress console output from Gurobi
-    if not print_out:
-        model.Params.LogToConsole = 0
-
-    # Model Parameters(Stopping Condition)
-    model.Params.TimeLimit = runtime_limit
-    # model.Params.MIPGap = 3e-2
-
     # Decision Variables
     x = model.addVars(vertices, vertices, K, V_d, vtype=GRB.BINARY, name="Routing")
     y = model.addVars(vertices, K, V_d, vtype=GRB.BINARY, name="Assignment")
@@ -147,44 +145,12 @@ def run_F3(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800
                                    for i in V_c)
     )
 
-    model.optimize()
-
-    # Objective Value:
-    objective_value = model.getObjective().getValue()
-    if print_out:
-        print(f"Objective: {objective_value}")
-
-    # Solution Routes:
-    solution = []
-    for i, j in arcs:
-        for k in K:
-            for d in V_d:
-                if round(x[i, j, k, d].X) == 1.0:
-                    if print_out:
-                        print(i, j)
-                    solution.append((i, j))
-
-    # Save Runtime for comparison 
-    runtime = model.Runtime
+    return model, x
 
-    # Save MIP Gap for comparison
-    mip_gap = model.MIPGap
 
-    model.dispose()
-    return objective_value, solution, runtime, mip_gap
-
-
-def run_F4(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800, print_out=False):
+def build_F4(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q):
     model = gp.Model("Compact formulation with disaggregated loading variables")
 
-    # supress console output from Gurobi
-    if not print_out:
-        model.Params.LogToConsole = 0
-
-    # Model Parameters(Stopping Condition)
-    model.Params.TimeLimit = runtime_limit
-    # model.Params.MIPGap = 3e-2
-
     # Decision Variables
     x = model.addVars(vertices, vertices, K, V_d, vtype=GRB.BINARY, name="Routing")
     y = model.addVars(vertices, K, V_d, vtype=GRB.BINARY, name="Assignment")
@@ -322,44 +288,12 @@ def run_F4(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800
                                    for i in V_c)
     )
 
-    model.optimize()
+    return model, x
 
-    # Objective Value:
-    objective_value = model.getObjective().getValue()
-    if print_out:
-        print(f"Objective: {objective_value}")
 
-    # Solution Routes:
-    solution = []
-    for i, j in arcs:
-        for k in K:
-            for d in V_d:
-                if round(x[i, j, k, d].X) == 1.0:
-                    if print_out:
-                        print(i, j)
-                    solution.append((i, j))
-
-    # Save Runtime for comparison 
-    runtime = model.Runtime
-
-    # Save MIP Gap for comparison
-    mip_gap = model.MIPGap
-
-    model.dispose()
-    return objective_value, solution, runtime, mip_gap
-
-
-def run_F5(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800, print_out=False):
+def build_F5(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q):
     model = gp.Model("Capacity-indexed formulation")
 
-    # supress console output from Gurobi
-    if not print_out:
-        model.Params.LogToConsole = 0
-
-    # Model Parameters(Stopping Condition)
-    model.Params.TimeLimit = runtime_limit
-    # model.Params.MIPGap = 3e-2
-
     # Decision Variables
     x = {}
     for i in vertices:
@@ -367,7 +301,8 @@ def run_F5(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800
             for k in K:
                 for d in V_d:
                     for q in range(0, Q[k] + 1):
-                        x[i, j, k, d, q] = model.addVar(vtype=GRB.BINARY, name="Routing")
+                        x[i, j, k, d, q] = model.addVar(vtype=GRB.BINARY,
+                                                       name=f"Routing[{i},{j},{k},{d},{q}]")
 
     ## fixed cost
     FC = gp.quicksum(gp.quicksum(gp.quicksum(gp.quicksum(F[k] * x[d, i, k, d, q]
@@ -475,6 +410,214 @@ def run_F5(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800
         for i in V_c
     )
 
+    return model, x
+
+
+# Content-addressed cache of built models:
+# every entry is a compressed MPS file plus a mapping from variable index to the x-keys of the formulation,
+# named after the sha256 of the formulation and the instance data
+CACHE_VERSION = 1
+CACHE_SIZE_LIMIT = 2 * 1024 ** 3
+# temporary files older than this (in seconds) are left over from interrupted writes
+CACHE_TMP_MAX_AGE = 24 * 3600
+
+BUILDERS = {"F3": build_F3, "F4": build_F4, "F5": build_F5}
+
+
+def _to_json(obj):
+    # numpy scalars / arrays (e.g. distances, alpha) are not JSON serializable
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return str(obj)
+
+
+def model_key(formulation, demands, vertices, arcs, V_d, V_c, F, alpha, K, Q):
+    """
+    Function to hash the formulation and the instance data of a model
+    Arguments:
+        formulation: name of the formulation ("F3", "F4" or "F5")
+        demands, vertices, arcs, V_d, V_c, F, alpha, K, Q: the dataset as returned by XML_Parser.gen_dataset
+    Return:
+        key: hex digest identifying the built model
+    """
+    instance = {
+        "cache_version": CACHE_VERSION,
+        "gurobi_version": gp.gurobi.version(),
+        "formulation": formulation,
+        "demands": [[i, demands[i]] for i in demands],
+        "vertices": list(vertices),
+        "arcs": [[i, j, arcs[i, j]] for (i, j) in arcs],
+        "V_d": list(V_d),
+        "V_c": list(V_c),
+        "F": list(F),
+        "alpha": list(alpha),
+        "K": list(K),
+        "Q": list(Q),
+    }
+    data = json.dumps(instance, default=_to_json, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _cache_paths(cache_dir, key):
+    return os.path.join(cache_dir, key + ".mps.gz"), os.path.join(cache_dir, key + ".json.gz")
+
+
+def _write_cache(model, x, cache_dir, key):
+    model_path, mapping_path = _cache_paths(cache_dir, key)
+    # unique per write, so parallel processes and threads never share a temporary file
+    tmp = f".{uuid.uuid4().hex}.tmp"
+
+    # write to temporary files first, so parallel runs never read a half written entry;
+    # the mapping file is moved last and marks the entry as complete
+    tmp_paths = (os.path.join(cache_dir, key + tmp + ".mps.gz"), mapping_path + tmp)
+    try:
+        model.update()
+        model.write(tmp_paths[0])
+        with gzip.open(tmp_paths[1], "wt") as f:
+            json.dump([[var.index, list(index)] for index, var in x.items()], f, default=_to_json)
+
+        os.replace(tmp_paths[0], model_path)
+        os.replace(tmp_paths[1], mapping_path)
+    except (OSError, gp.GurobiError):
+        # e.g. disk full => remove the temporary files of this write and re-raise
+        for path in tmp_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        raise
+
+
+def _read_cache(cache_dir, key, print_out=False):
+    model_path, mapping_path = _cache_paths(cache_dir, key)
+    if not (os.path.exists(model_path) and os.path.exists(mapping_path)):
+        return None
+
+    model = None
+    try:
+        with gzip.open(mapping_path, "rt") as f:
+            mapping = json.load(f)
+
+        if print_out:
+            model = gp.read(model_path)
+        else:
+            # supress console output from Gurobi while reading the file
+            env = gp.Env(empty=True)
+            env.setParam("LogToConsole", 0)
+            env.start()
+            model = gp.read(model_path, env)
+            # keep the environment alive as long as the model
+            model._cache_env = env
+
+        # rebuild the x-keys from the variable indices, MPS keeps the order of the columns
+        variables = model.getVars()
+        x = gp.tupledict({tuple(index): variables[i] for i, index in mapping})
+
+        # mark the entry as recently used for the eviction
+        for path in (model_path, mapping_path):
+            os.utime(path)
+    except (OSError, ValueError, TypeError, IndexError, gp.GurobiError):
+        # entry got evicted in between or is corrupted => rebuild it
+        if model is not None:
+            model.dispose()
+        return None
+
+    return model, x
+
+
+def evict_cache(cache_dir, size_limit=CACHE_SIZE_LIMIT):
+    """
+    Function to delete the least recently used models until the cache fits in size_limit
+    Arguments:
+        cache_dir: directory of the model cache
+        size_limit: maximum total size of the cache in bytes
+    Return: None
+    """
+    entries = {}
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+            if ".tmp" in name:
+                # skip running writes, delete the ones of interrupted writes
+                if time.time() - stat.st_mtime > CACHE_TMP_MAX_AGE:
+                    os.remove(path)
+                continue
+        except FileNotFoundError:
+            # removed by a parallel eviction in between
+            continue
+        size, last_used = entries.get(name.split(".")[0], (0, 0))
+        entries[name.split(".")[0]] = (size + stat.st_size, max(last_used, stat.st_mtime))
+
+    total_size = sum(size for size, _ in entries.values())
+    for key, (size, _) in sorted(entries.items(), key=lambda entry: entry[1][1]):
+        if total_size <= size_limit:
+            break
+        # remove the mapping first, so the entry is never picked up half deleted
+        for path in reversed(_cache_paths(cache_dir, key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total_size -= size
+
+
+def get_model(formulation, demands, vertices, arcs, V_d, V_c, F, alpha, K, Q,
+              cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT, print_out=False):
+    """
+    Function to build a model or load it from the model cache
+    Arguments:
+        formulation: name of the formulation ("F3", "F4" or "F5")
+        demands, vertices, arcs, V_d, V_c, F, alpha, K, Q: the dataset as returned by XML_Parser.gen_dataset
+        cache_dir: directory of the model cache, None to always build the model in Python
+        cache_size_limit: maximum total size of the cache in bytes
+        print_out: show the Gurobi output while reading a cached model
+    Return:
+        model: the Gurobi model
+        x: tupledict of the routing variables
+    """
+    data = (demands, vertices, arcs, V_d, V_c, F, alpha, K, Q)
+    if cache_dir is None:
+        return BUILDERS[formulation](*data)
+
+    key = model_key(formulation, *data)
+    cached = _read_cache(cache_dir, key, print_out)
+    if cached is not None:
+        return cached
+
+    model, x = BUILDERS[formulation](*data)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_cache(model, x, cache_dir, key)
+        evict_cache(cache_dir, cache_size_limit)
+    except (OSError, gp.GurobiError) as e:
+        # the cache is only an optimization => keep going with the built model
+        if print_out:
+            print(f"Could not write the model cache: {e}")
+    return model, x
+
+
+def get_solution(x, arcs, print_out=False):
+    # Solution Routes:
+    solution = []
+    for index, var in x.items():
+        i, j = index[:2]
+        if (i, j) in arcs and round(var.X) == 1.0:
+            if print_out:
+                print(i, j, *index[4:])
+            solution.append((i, j))
+    return solution
+
+
+def solve(model, x, arcs, runtime_limit=1800, print_out=False):
+    # supress console output from Gurobi
+    if not print_out:
+        model.Params.LogToConsole = 0
+
+    # Model Parameters(Stopping Condition)
+    model.Params.TimeLimit = runtime_limit
+    # model.Params.MIPGap = 3e-2
+
     model.optimize()
 
     # Objective Value:
@@ -482,18 +625,9 @@ def run_F5(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800
     if print_out:
         print(f"Objective: {objective_value}")
 
-    # Solution Routes:
-    solution = []
-    for i, j in arcs:
-        for k in K:
-            for d in V_d:
-                for q in range(0, Q[k] + 1):
-                    if round(x[i, j, k, d, q].X) == 1.0:
-                        if print_out:
-                            print(i, j, q)
-                        solution.append((i, j))
-
-    # Save Runtime for comparison 
+    solution = get_solution(x, arcs, print_out)
+
+    # Save Runtime for comparison
     runtime = model.Runtime
 
     # Save MIP Gap for comparison
@@ -501,3 +635,24 @@ def run_F5(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800
 
     model.dispose()
     return objective_value, solution, runtime, mip_gap
+
+
+def run_F3(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800, print_out=False,
+           cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT):
+    model, x = get_model("F3", demands, vertices, arcs, V_d, V_c, F, alpha, K, Q,
+                         cache_dir, cache_size_limit, print_out)
+    return solve(model, x, arcs, runtime_limit, print_out)
+
+
+def run_F4(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800, print_out=False,
+           cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT):
+    model, x = get_model("F4", demands, vertices, arcs, V_d, V_c, F, alpha, K, Q,
+                         cache_dir, cache_size_limit, print_out)
+    return solve(model, x, arcs, runtime_limit, print_out)
+
+
+def run_F5(demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, runtime_limit=1800, print_out=False,
+           cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT):
+    model, x = get_model("F5", demands, vertices, arcs, V_d, V_c, F, alpha, K, Q,
+                         cache_dir, cache_size_limit, print_out)
+    return solve(model, x, arcs, runtime_limit, print_out)
@@ -0,0 +1,258 @@
+import gurobipy as gp
+from gurobipy import GRB
+import math
+
+from Models import CACHE_SIZE_LIMIT, get_model, get_solution
+
+
+def mip_gap(objective_bound, objective_best):
+    # relative MIP gap as defined by Gurobi, infinite as long as there is no incumbent
+    if abs(objective_best) >= GRB.INFINITY:
+        return math.inf
+    if objective_best == 0:
+        return 0.0 if objective_bound == 0 else math.inf
+    return abs(objective_best - objective_bound) / abs(objective_best)
+
+
+def bound_improvement(bound_before, bound_after):
+    # relative increase of the (minimization) bound, the first finite bound counts as progress;
+    # None as long as there is no bound at all, which is not the same as a bound that did not move
+    if bound_after <= -GRB.INFINITY:
+        return None
+    if bound_before <= -GRB.INFINITY:
+        return math.inf
+    return (bound_after - bound_before) / max(abs(bound_before), 1.0)
+
+
+def _improved(before, after, tolerance):
+    # relative increase of more than tolerance, the first finite value counts as improvement
+    if before <= -GRB.INFINITY:
+        return after > -GRB.INFINITY
+    return (after - before) / max(abs(before), 1.0) > tolerance
+
+
+def _progress_callback(model, where):
+    """
+    Gurobi callback to keep track of the incumbent and the bound of a job and to pause the job
+    once neither of them improved by more than model._tolerance for model._stall_time seconds
+    """
+    if where != GRB.Callback.MIP:
+        return
+
+    runtime = model.cbGet(GRB.Callback.RUNTIME)
+    objective_best = model.cbGet(GRB.Callback.MIP_OBJBST)
+    objective_bound = model.cbGet(GRB.Callback.MIP_OBJBND)
+
+    job = model._job
+    job.incumbent = objective_best
+    job.bound = objective_bound
+    job.in_tree = True
+
+    # first slice of a job that needed longer than slice_time to reach branch-and-bound
+    if runtime >= model._slice_time:
+        model.terminate()
+        return
+
+    # minimization => the incumbent has to decrease, the bound has to increase
+    if _improved(-model._progress_incumbent, -objective_best, model._tolerance) or \
+            _improved(model._progress_bound, objective_bound, model._tolerance):
+        model._progress_incumbent = objective_best
+        model._progress_bound = objective_bound
+        model._last_progress = runtime
+    elif runtime - model._last_progress > model._stall_time:
+        model.terminate()
+
+
+class Job:
+    def __init__(self, formulation, demands, vertices, arcs, V_d, V_c, F, alpha, K, Q, time_limit=3600,
+                 info=None, cache_dir=None, cache_size_limit=CACHE_SIZE_LIMIT):
+        """
+        A single model of a benchmark campaign that can be solved in several time slices
+        Arguments:
+            formulation: name of the formulation ("F3", "F4" or "F5")
+            demands, vertices, arcs, V_d, V_c, F, alpha, K, Q: the dataset as returned by XML_Parser.gen_dataset
+            time_limit: maximum runtime of the job over all slices
+            info: additional columns for the result (e.g. {"datasets": "br17", "n_nodes": 17})
+            cache_dir, cache_size_limit: model cache, see Models.get_model
+        """
+        self.formulation = formulation
+        self.arcs = arcs
+        self.time_limit = time_limit
+        self.info = info if info is not None else {}
+
+        # the model is built (or loaded from the cache) on its first slice and kept in memory together with its
+        # branch-and-bound tree until the job finishes; every job runs a first slice early in the campaign,
+        # so all models of a campaign are in memory at the same time
+        self.data = (demands, vertices, arcs, V_d, V_c, F, alpha, K, Q)
+        self.cache_dir = cache_dir
+        self.cache_size_limit = cache_size_limit
+        self.model = None
+        self.x = None
+
+        # latest incumbent and bound seen by the callback
+        self.incumbent = GRB.INFINITY
+        self.bound = -GRB.INFINITY
+        # presolve and root relaxation start over if interrupted, a slice only resumes once branch-and-bound started
+        self.in_tree = False
+        self.runtime = 0.0
+        self.gap = math.inf
+        # gap improvement per second of the last slice, jobs that did not run yet come first
+        self.rate = math.inf
+        self.stalled_slices = 0
+        # "plateau" jobs are paused and only resumed once no other job is improving anymore
+        self.status = "pending"
+        self.done = False
+        self.objective_value = None
+        self.solution = []
+
+    @property
+    def active(self):
+        return self.status in ("pending", "running")
+
+    def run_slice(self, slice_time, max_time, stall_time, tolerance, print_out=False):
+        """
+        Function to continue the optimization of the job for at most slice_time seconds
+        Gurobi resumes the branch-and-bound tree of the previous slice, as the model is not changed in between.
+        Until branch-and-bound started, the slice is extended up to max_time, otherwise the next slice
+        would repeat presolve and root relaxation.
+        Return:
+            improvement: decrease of the MIP gap during the slice,
+                         relative increase of the bound as long as there is no incumbent,
+                         None if there is no bound yet either or branch-and-bound was not reached
+        """
+        if self.model is None:
+            self.model, self.x = get_model(self.formulation, *self.data, self.cache_dir, self.cache_size_limit,
+                                           print_out)
+            self.model._job = self
+
+        model = self.model
+        if not print_out:
+            model.Params.LogToConsole = 0
+        if self.in_tree:
+            model.Params.TimeLimit = min(slice_time, max_time)
+            model._slice_time = math.inf
+        else:
+            # the callback ends the slice once branch-and-bound started and slice_time is over
+            model.Params.TimeLimit = max_time
+            model._slice_time = slice_time
+        model._stall_time = stall_time
+        model._tolerance = tolerance
+        model._progress_incumbent = self.incumbent
+        model._progress_bound = self.bound
+        model._last_progress = 0.0
+
+        gap_before = self.gap
+        bound_before = self.bound
+        model.optimize(_progress_callback)
+        self.runtime += model.Runtime
+        self.status = "running"
+
+        # the callback might not have been called in this slice, the model has the latest bound
+        try:
+            self.bound = model.ObjBound
+        except gp.GurobiError:
+            # no bound before the root relaxation is solved
+            pass
+
+        if model.SolCount > 0:
+            self.gap = mip_gap(model.ObjBound, model.ObjVal)
+
+        if model.Status in (GRB.OPTIMAL, GRB.INFEASIBLE, GRB.INF_OR_UNBD, GRB.UNBOUNDED):
+            self.finish("optimal" if model.Status == GRB.OPTIMAL else "infeasible")
+        elif self.runtime >= self.time_limit:
+            self.finish("time_limit")
+
+        if not self.in_tree:
+            # only happens if max_time ran out, which says nothing about the progress of the job
+            return None
+        if math.isinf(gap_before):
+            # the first incumbent counts as progress, until then the bound shows whether the search advances
+            return math.inf if not math.isinf(self.gap) else bound_improvement(bound_before, self.bound)
+        return gap_before - self.gap
+
+    def finish(self, status):
+        # store the results and free the memory of the model
+        if self.done:
+            return
+        self.done = True
+        self.status = status
+        if self.model is None:
+            return
+        if self.model.SolCount > 0:
+            self.objective_value = self.model.ObjVal
+            self.solution = get_solution(self.x, self.arcs)
+        self.model.dispose()
+        self.model = None
+
+    def result(self):
+        return {
+            **self.info,
+            "models": self.formulation,
+            "obj_val": self.objective_value,
+            "runtime": self.runtime,
+            "mip_gap": self.gap,
+            "status": self.status,
+        }
+
+
+def run_campaign(jobs, total_budget, slice_time=60, stall_time=30, min_improvement=1e-3, patience=3,
+                 print_out=False):
+    """
+    Function to solve a set of jobs within a shared time budget
+    The budget is handed out in slices, always to the job that improved its MIP gap the fastest in its last slice.
+    Jobs whose gap improved less than min_improvement for patience slices in a row are paused,
+    their time goes to the jobs that are still improving. Jobs without an incumbent are only paused
+    once their bound stops moving. When all jobs are paused, they are resumed with the remaining budget.
+    Arguments:
+        jobs: list of Job
+        total_budget: total runtime in seconds shared by all jobs
+        slice_time: maximum runtime of a single slice, the first slice of a job runs until branch-and-bound starts
+        stall_time: a slice ends early once neither incumbent nor bound improved (relatively) by more than
+                    min_improvement for stall_time seconds
+        min_improvement: minimal decrease of the MIP gap for a slice to count as progress
+        patience: number of slices without progress before a job is paused
+        print_out: show the Gurobi log
+    Return:
+        results: list of dictionaries with the result and the used runtime of every job
+    """
+    remaining = total_budget
+    while remaining > 0:
+        active = [job for job in jobs if job.active]
+        if not active:
+            paused = [job for job in jobs if job.status == "plateau"]
+            if not paused:
+                break
+            # every job has plateaued => resume them instead of leaving the budget unused
+            for job in paused:
+                job.status = "running"
+                job.stalled_slices = 0
+            active = paused
+
+        # fastest improving job first, least used one on ties
+        job = max(active, key=lambda job: (job.rate, -job.runtime))
+        budget = min(remaining, job.time_limit - job.runtime)
+
+        runtime_before = job.runtime
+        improvement = job.run_slice(slice_time, budget, stall_time, min_improvement, print_out)
+        used = job.runtime - runtime_before
+        remaining -= used
+
+        # before branch-and-bound or without any bound the progress of the slice cannot be judged
+        if improvement is not None:
+            job.rate = improvement / max(used, 1e-6)
+            if improvement <= 0 or (not math.isinf(job.gap) and improvement < min_improvement):
+                job.stalled_slices += 1
+            else:
+                job.stalled_slices = 0
+
+        if job.active and job.stalled_slices >= patience:
+            job.status = "plateau"
+
+        if print_out:
+            print(f"{job.formulation} {job.info}: gap {job.gap:.4f} after {job.runtime:.1f}s ({job.status})")
+
+    # jobs left over when the budget is used up
+    for job in jobs:
+        job.finish("plateau" if job.status == "plateau" else "budget")
+
+    return [job.result() for job in jobs]